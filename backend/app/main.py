@@ -2,18 +2,24 @@
 FastAPI application for Kidney Biopsy Report Generator
 """
 
+import hashlib
 import logging
-from typing import List, Optional
+import re
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from app.models.shorthand import (
     CaseCode,
     ConclusionCode,
     GeneratedReport,
+    LineMapping,
     PhraseEntryPayload,
     PhraseEntryResponse,
     ShorthandInput,
@@ -24,11 +30,24 @@ from app.services.simple_mapper import SimpleMapper
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# The live preview posts on nearly every keystroke; per-request access lines
+# only add logging-lock contention on the worker threads.
+logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm lookup caches so the first preview request runs at steady state."""
+    generate_report(ShorthandInput(shorthand_text="!g g0 @x@ !conc bl \n"))
+    yield
+
 
 app = FastAPI(
     title="Kidney Biopsy Report Generator",
     description="API for generating kidney biopsy reports from shorthand notation",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -41,6 +60,59 @@ app.add_middleware(
 
 simple_mapper = SimpleMapper()
 
+SECTION_HEADERS = {
+    "!conc": "conclusion",
+    "!com": "comments",
+    "!lm": "main_body",
+    "!g": "main_body",
+    "!t": "main_body",
+    "!bv": "main_body",
+    "!ihc": "main_body",
+    "!ip": "main_body",
+    "!ifp": "main_body",
+    "!em": "main_body",
+    "!iff": "main_body",
+}
+
+# Completed tokens expand only when followed by a space or newline; a token
+# ending at "@" or end of input is emitted as typed. Protected blocks close at
+# the first "@" followed by a boundary or end of input, otherwise the rest of
+# the input is kept literally with its opening "@". Both rules need lookahead,
+# which RE2 and Hyperscan do not support, so this stays on the stdlib engine.
+# Completed tokens starting with "!" (after any tab-like whitespace, which the
+# mapper strips) are matched separately as structural headers.
+TOKEN_PATTERN = re.compile(
+    r"@(?P<protected>.*?)@(?=[ \n]|\Z)"
+    r"|@(?P<unclosed>.*)\Z"
+    r"|(?P<boundary>[ \n]+)"
+    r"|(?P<header>[^\S \n]*![^ \n@]*)(?=[ \n])"
+    r"|(?P<token>[^ \n@]+)(?=[ \n])"
+    r"|(?P<partial>[^ \n@]+)",
+    re.DOTALL,
+)
+
+
+@lru_cache(maxsize=1)
+def _phrases_payload(revision: int) -> Tuple[bytes, str]:
+    """Return the serialized flat mappings and their ETag for a dictionary revision."""
+    body = orjson.dumps(simple_mapper.get_all_mappings())
+    return body, f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Return True when an If-None-Match header matches ``etag``.
+
+    Uses weak comparison over the comma-separated member list, so a ``W/``
+    tag from a compressing proxy still matches, and ``*`` matches any tag.
+    """
+    if not if_none_match:
+        return False
+    for member in if_none_match.split(","):
+        member = member.strip()
+        if member == "*" or member.removeprefix("W/") == etag:
+            return True
+    return False
+
 
 class AutocompleteRequest(BaseModel):
     """Request model for autocomplete endpoint."""
@@ -77,119 +149,123 @@ async def health_check():
 
 
 @app.post("/api/generate", response_model=GeneratedReport)
-async def generate_report(input_data: ShorthandInput):
+def generate_report(input_data: ShorthandInput):
     """Generate a kidney biopsy report from shorthand notation."""
     try:
         shorthand = input_data.shorthand_text
         if not shorthand:
-            return GeneratedReport(report_text="")
-
-        section_headers = {
-            "!conc": "conclusion",
-            "!com": "comments",
-            "!lm": "main_body",
-            "!g": "main_body",
-            "!t": "main_body",
-            "!bv": "main_body",
-            "!ihc": "main_body",
-            "!ip": "main_body",
-            "!ifp": "main_body",
-            "!em": "main_body",
-            "!iff": "main_body",
-        }
+            return GeneratedReport.model_construct(report_text="")
+
+        # A lone unfinished token never expands, so skip the tokenizer entirely.
+        if (
+            not input_data.include_line_mappings
+            and " " not in shorthand
+            and "\n" not in shorthand
+            and "@" not in shorthand
+        ):
+            return GeneratedReport.model_construct(report_text=shorthand)
 
         current_section = "main_body"
         conclusion_keys = []
         case_codes: List[CaseCode] = []
         seen_case_code_keys = set()
 
-        output = []
-        current_token = ""
-        in_protected_block = False
-        protected_content = ""
-
-        i = 0
-        while i < len(shorthand):
-            char = shorthand[i]
-
-            if char == "@":
-                if in_protected_block:
-                    next_char = shorthand[i + 1] if i + 1 < len(shorthand) else ""
-                    if next_char in [" ", "\n"] or next_char == "":
-                        output.append(protected_content)
-                        protected_content = ""
-                        in_protected_block = False
-                        i += 1
-                        if next_char:
-                            output.append(next_char)
-                            i += 1
-                        continue
-                    protected_content += char
-                else:
-                    if current_token:
-                        output.append(current_token)
-                        current_token = ""
-                    in_protected_block = True
-                    protected_content = ""
-
-            elif in_protected_block:
-                protected_content += char
-
-            elif char in [" ", "\n"]:
-                if current_token:
-                    token_lower = current_token.lower().strip()
-
-                    if token_lower.startswith("!"):
-                        expansion = simple_mapper.map_code(current_token, section="main_body")
-                        if expansion:
-                            if output and output[-1] != "\n":
-                                output.append("\n")
-                            output.append(expansion)
-                        else:
-                            output.append(current_token)
-
-                        if token_lower in section_headers:
-                            current_section = section_headers[token_lower]
-                    else:
-                        expansion = simple_mapper.map_code(current_token, section=current_section)
-                        output.append(expansion if expansion else current_token)
-
-                        case_code = simple_mapper.get_case_code(current_token, current_section)
-                        if case_code and case_code["key"] not in seen_case_code_keys:
-                            case_codes.append(CaseCode(**case_code))
-                            seen_case_code_keys.add(case_code["key"])
-
-                        if current_section == "conclusion":
-                            conclusion_keys.append(token_lower)
-
-                    current_token = ""
-
-                output.append(char)
-
-            else:
-                current_token += char
-
-            i += 1
-
-        if in_protected_block:
-            output.append("@" + protected_content)
-        elif current_token:
-            output.append(current_token)
-
-        report_text = "".join(output)
+        # Completed tokens always start the input or follow a boundary run,
+        # so the last boundary character is all the header check needs.
+        last_char = ""
+
+        def expand(match: re.Match) -> str:
+            nonlocal current_section, last_char
+            kind = match.lastgroup
+
+            if kind == "protected":
+                return match.group("protected")
+            if kind == "boundary":
+                last_char = match.group(0)[-1]
+                return match.group(0)
+            if kind in ("unclosed", "partial"):
+                return match.group(0)
+
+            current_token = match.group(kind)
+            token_lower = current_token.lower().strip()
+            if kind == "header":
+                expansion = simple_mapper.map_code(current_token, section="main_body")
+                current_section = SECTION_HEADERS.get(token_lower, current_section)
+                if not expansion:
+                    return current_token
+                if last_char and last_char != "\n":
+                    return "\n" + expansion
+                return expansion
+
+            expansion = simple_mapper.map_code(current_token, section=current_section)
+
+            case_code = simple_mapper.get_case_code(current_token, current_section)
+            if case_code and case_code["key"] not in seen_case_code_keys:
+                case_codes.append(CaseCode(**case_code))
+                seen_case_code_keys.add(case_code["key"])
+
+            if current_section == "conclusion":
+                conclusion_keys.append(token_lower)
+
+            return expansion if expansion else current_token
+
+        line_mappings: List[LineMapping] = []
+        if input_data.include_line_mappings:
+            line_number = 1
+            line_parts: List[str] = []
+            line_source = ""
+
+            def close_line() -> None:
+                nonlocal line_number
+                line_text = "".join(line_parts)
+                if line_text.strip():
+                    line_mappings.append(
+                        LineMapping.model_construct(
+                            line_number=line_number,
+                            source_code=line_source,
+                            original_text=line_text,
+                        )
+                    )
+                line_parts.clear()
+                line_number += 1
+
+            def expand_and_track(match: re.Match) -> str:
+                nonlocal line_source
+                text = expand(match)
+                # An expanded token is the source of every line its text lands on.
+                source = ""
+                if match.lastgroup in ("header", "token") and text != match.group(0):
+                    source = match.group(match.lastgroup)
+                *closed_lines, open_line = text.split("\n")
+                for closed_line in closed_lines:
+                    if source and closed_line:
+                        line_source = source
+                    line_parts.append(closed_line)
+                    close_line()
+                    line_source = ""
+                if source and open_line:
+                    line_source = source
+                line_parts.append(open_line)
+                return text
+
+            report_text = TOKEN_PATTERN.sub(expand_and_track, shorthand)
+            close_line()
+        else:
+            report_text = TOKEN_PATTERN.sub(expand, shorthand)
 
         extracted_codes = []
         seen_conclusion_pairs = set()
         for key in conclusion_keys:
             for code in simple_mapper.get_conclusion_codes(key, input_data.report_type):
                 if (key, code) not in seen_conclusion_pairs:
-                    extracted_codes.append(ConclusionCode(key=key, code=code))
+                    extracted_codes.append(ConclusionCode.model_construct(key=key, code=code))
                     seen_conclusion_pairs.add((key, code))
 
-        return GeneratedReport(
+        return GeneratedReport.model_construct(
             report_text=report_text,
             conclusion_codes=extracted_codes,
             case_codes=case_codes,
+            line_mappings=line_mappings,
         )
 
     except Exception as e:
@@ -198,10 +274,10 @@ async def generate_report(input_data: ShorthandInput):
 
 
 @app.post("/api/export")
-async def export_report(input_data: ShorthandInput):
+def export_report(input_data: ShorthandInput):
     """Generate a report-type-specific XLSX export from shorthand notation."""
     try:
-        generated_report = await generate_report(input_data)
+        generated_report = generate_report(input_data)
         workbook_bytes = build_export_workbook(
             shorthand_text=input_data.shorthand_text,
             report_type=input_data.report_type,
@@ -223,17 +299,17 @@ async def export_report(input_data: ShorthandInput):
 
 
 @app.post("/api/validate", response_model=ValidationResponse)
-async def validate_codes(input_data: ShorthandInput):
+def validate_codes(input_data: ShorthandInput):
     """Validate shorthand codes without generating a full report."""
     try:
-        return ValidationResponse(is_valid=True)
+        return ValidationResponse.model_construct(is_valid=True)
     except Exception as e:
         logger.error(f"Error validating codes: {str(e)}")
-        return ValidationResponse(is_valid=False)
+        return ValidationResponse.model_construct(is_valid=False)
 
 
 @app.get("/api/phrases/entries", response_model=List[PhraseEntryResponse])
-async def list_phrase_entries():
+def list_phrase_entries():
     """Return structured phrase entries for frontend phrase management."""
     try:
         return simple_mapper.get_phrase_entries()
@@ -243,7 +319,7 @@ async def list_phrase_entries():
 
 
 @app.put("/api/phrases/entries/{phrase_key}", response_model=PhraseEntryResponse)
-async def upsert_phrase_entry(phrase_key: str, payload: PhraseEntryPayload):
+def upsert_phrase_entry(phrase_key: str, payload: PhraseEntryPayload):
     """Create or update a phrase entry and persist it to the runtime dictionary."""
     try:
         return simple_mapper.upsert_phrase_entry(phrase_key, payload.dict())
@@ -255,7 +331,7 @@ async def upsert_phrase_entry(phrase_key: str, payload: PhraseEntryPayload):
 
 
 @app.delete("/api/phrases/entries/{phrase_key}", response_model=PhraseEntryResponse)
-async def delete_phrase_entry(phrase_key: str):
+def delete_phrase_entry(phrase_key: str):
     """Delete a phrase entry from the runtime dictionary."""
     try:
         return simple_mapper.delete_phrase_entry(phrase_key)
@@ -277,23 +353,29 @@ async def download_phrase_dictionary():
 
 
 @app.post("/api/autocomplete", response_model=AutocompleteResponse)
-async def autocomplete(request: AutocompleteRequest):
+def autocomplete(request: AutocompleteRequest):
     """Convert a single shorthand code to its full medical phrase."""
     try:
         expansion = simple_mapper.map_code(request.code)
-        return AutocompleteResponse(code=request.code, expansion=expansion)
+        return AutocompleteResponse.model_construct(code=request.code, expansion=expansion)
     except Exception as e:
         logger.error(f"Error in autocomplete: {str(e)}")
-        return AutocompleteResponse(code=request.code, expansion=None)
+        return AutocompleteResponse.model_construct(code=request.code, expansion=None)
 
 
 @app.get("/api/phrases/{report_type}")
-async def get_phrases(report_type: str):
+def get_phrases(report_type: str, request: Request):
     """Get available phrase mappings for a report type."""
     if report_type not in ["transplant", "native"]:
         raise HTTPException(status_code=400, detail="Invalid report type")
 
-    return simple_mapper.get_all_mappings()
+    body, etag = _phrases_payload(simple_mapper.revision)
+    # Phrase edits change the payload at runtime, so clients must revalidate.
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 if __name__ == "__main__":
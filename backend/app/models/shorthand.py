@@ -23,6 +23,10 @@ class ShorthandInput(BaseModel):
 
     shorthand_text: str = Field(..., description="Raw shorthand text input")
     report_type: str = Field(default="transplant", description="Type of report (transplant or native)")
+    include_line_mappings: bool = Field(
+        default=False,
+        description="Whether to return per-line source mappings for the generated report",
+    )
 
 
 class CodingGroup(BaseModel):
@@ -4,24 +4,56 @@ Parses shorthand codes into structured data
 """
 
 import re
-from typing import Dict, List, Any, Optional
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
+
+_RE_DIGITS = re.compile(r'\d+')
+_RE_IL_AR = re.compile(r'(\d+)IL_(\d+)Ar')
+_RE_CM = re.compile(r'C(\d+)M(\d+)')
+_RE_C = re.compile(r'C(\d+)')
+_RE_A = re.compile(r'A\d+')
+# One "key: value" line; both parts come back with surrounding whitespace removed
+_RE_LINE = re.compile(r'^[^\S\n]*([^:\n]*?)[^\S\n]*:[^\S\n]*(.*?)[^\S\n]*$', re.MULTILINE)
+
+_SECTION_MAPPING = {
+    'LM': 'light_microscopy',
+    'Glom': 'glomeruli',
+    'TI': 'tubulointerstitium',
+    'Ves': 'blood_vessels',
+    'IHC': 'immunohistochemistry',
+    'EM': 'electron_microscopy',
+    'IFFR': 'immunofluorescence',
+    'CONCLUSION': 'conclusion',
+    'COMMENT': 'comment'
+}
+
+_PATIENT_FIELD_MAPPING = {
+    'nhs': 'nhs_number',
+    'hn': 'hospital_number',
+    'ns': 'ns_number',
+    'name': 'name',
+    'coder': 'coder',
+    'consent': 'consent'
+}
 
 
 class ShorthandParser:
     """Parser for converting shorthand notation to structured data"""
     
+    __slots__ = ('section_mapping', 'patient_field_mapping', '_compound_handlers', '_parse_cached')
+    
     def __init__(self):
-        self.section_mapping = {
-            'LM': 'light_microscopy',
-            'Glom': 'glomeruli',
-            'TI': 'tubulointerstitium',
-            'Ves': 'blood_vessels',
-            'IHC': 'immunohistochemistry',
-            'EM': 'electron_microscopy',
-            'IFFR': 'immunofluorescence',
-            'CONCLUSION': 'conclusion',
-            'COMMENT': 'comment'
+        # Shared lookup tables; treat as read-only
+        self.section_mapping = _SECTION_MAPPING
+        self.patient_field_mapping = _PATIENT_FIELD_MAPPING
+        self._compound_handlers = {
+            'I': self._parse_ifta_code,
+            'G': self._parse_gs_code,
+            'S': self._parse_ss_code,
+            'C': self._parse_sample_code,
+            'A': self._parse_artery_code
         }
+        self._parse_cached = lru_cache(maxsize=1024)(self._parse_frozen)
     
     def parse(self, shorthand_text: str) -> Dict[str, Any]:
         """
@@ -33,51 +65,44 @@ class ShorthandParser:
         Returns:
             Structured dictionary with parsed data
         """
+        # Repeated inputs are served from the cache; callers get fresh
+        # containers they are free to modify
+        patient_info, sections = self._parse_cached(shorthand_text)
+        return {
+            'patient_info': dict(patient_info),
+            'sections': {name: list(codes) for name, codes in sections}
+        }
+    
+    def _parse_frozen(self, shorthand_text: str) -> Tuple[Tuple, Tuple]:
+        """Parse shorthand text into immutable (patient_info, sections) pairs"""
         result = {
             'patient_info': {},
             'sections': {}
         }
         
-        lines = shorthand_text.strip().split('\n')
-        current_section = None
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        # Lines without a ':' never match and are skipped
+        for match in _RE_LINE.finditer(shorthand_text):
+            key, value = match.groups()
             
-            # Check if it's a section header
-            if ':' in line:
-                parts = line.split(':', 1)
-                key = parts[0].strip()
-                value = parts[1].strip() if len(parts) > 1 else ''
-                
-                # Check if it's a known section
-                if key in self.section_mapping:
-                    current_section = self.section_mapping[key]
-                    result['sections'][current_section] = self._parse_section_codes(value)
-                # Otherwise it's patient info
-                else:
-                    self._parse_patient_info(key, value, result['patient_info'])
-        
-        return result
+            # Check if it's a known section
+            if key in self.section_mapping:
+                result['sections'][self.section_mapping[key]] = self._parse_section_codes(value)
+            # Otherwise it's patient info
+            else:
+                self._parse_patient_info(key, value, result['patient_info'])
+        
+        return (
+            tuple(result['patient_info'].items()),
+            tuple((name, tuple(codes)) for name, codes in result['sections'].items())
+        )
     
     def _parse_patient_info(self, key: str, value: str, patient_info: Dict):
         """Parse patient information fields"""
         key_lower = key.lower()
+        field = self.patient_field_mapping.get(key_lower)
         
-        if key_lower == 'nhs':
-            patient_info['nhs_number'] = value
-        elif key_lower == 'hn':
-            patient_info['hospital_number'] = value
-        elif key_lower == 'ns':
-            patient_info['ns_number'] = value
-        elif key_lower == 'name':
-            patient_info['name'] = value
-        elif key_lower == 'coder':
-            patient_info['coder'] = value
-        elif key_lower == 'consent':
-            patient_info['consent'] = value
+        if field:
+            patient_info[field] = value
         elif 'date' in key_lower:
             patient_info['date_of_biopsy'] = value
     
@@ -87,19 +112,11 @@ class ShorthandParser:
             return []
         
         # Split by comma but preserve spaces in codes like "ATI micro"
-        codes = []
-        current_code = ""
-        
-        for part in codes_str.split(','):
-            part = part.strip()
-            if part:
-                codes.append(part)
-        
-        return codes
+        return [code for code in (part.strip() for part in codes_str.split(',')) if code]
     
     def extract_numeric_value(self, code: str) -> Optional[int]:
         """Extract numeric value from codes like GS7, IFTA20"""
-        match = re.search(r'\d+', code)
+        match = _RE_DIGITS.search(code)
         if match:
             return int(match.group())
         return None
@@ -117,48 +134,54 @@ class ShorthandParser:
         
         # Handle artery types (2IL_1Ar)
         elif 'IL' in code and 'Ar' in code:
-            match = re.match(r'(\d+)IL_(\d+)Ar', code)
+            match = _RE_IL_AR.match(code)
             if match:
                 result['interlobular'] = int(match.group(1))
                 result['arcuate'] = int(match.group(2))
         
-        # Handle IFTA percentage
-        elif code.startswith('IFTA'):
+        # Remaining codes are told apart by their first character
+        else:
+            handler = self._compound_handlers.get(code[:1])
+            if handler:
+                handler(code, result)
+        
+        return result
+    
+    def _parse_ifta_code(self, code: str, result: Dict[str, Any]):
+        """Handle IFTA percentage (IFTA20)"""
+        if code.startswith('IFTA'):
             value = self.extract_numeric_value(code)
             if value:
                 result['percentage'] = value
-        
-        # Handle glomeruli counts
-        elif code.startswith('GS'):
+    
+    def _parse_gs_code(self, code: str, result: Dict[str, Any]):
+        """Handle globally sclerosed glomeruli counts (GS7)"""
+        if code.startswith('GS'):
             value = self.extract_numeric_value(code)
             if value:
                 result['count'] = value
                 result['type'] = 'globally_sclerosed'
-        
-        # Handle segmental sclerosis
-        elif code.startswith('SS'):
-            if '_' in code:
-                parts = code.split('_')
-                value = self.extract_numeric_value(parts[0])
-                if value:
-                    result['count'] = value
-                    result['variant'] = parts[1] if len(parts) > 1 else 'NOS'
-        
-        # Handle sample counts (C2M1)
-        elif re.match(r'C\d+M\d+', code):
-            match = re.match(r'C(\d+)M(\d+)', code)
-            if match:
-                result['cortex_count'] = int(match.group(1))
-                result['medulla_count'] = int(match.group(2))
-        elif re.match(r'C\d+', code):
-            match = re.match(r'C(\d+)', code)
-            if match:
-                result['cortex_count'] = int(match.group(1))
-        
-        # Handle artery count (A3)
-        elif re.match(r'A\d+', code):
+    
+    def _parse_ss_code(self, code: str, result: Dict[str, Any]):
+        """Handle segmental sclerosis (SS2_NOS)"""
+        if code.startswith('SS') and '_' in code:
+            parts = code.split('_')
+            value = self.extract_numeric_value(parts[0])
+            if value:
+                result['count'] = value
+                result['variant'] = parts[1] if len(parts) > 1 else 'NOS'
+    
+    def _parse_sample_code(self, code: str, result: Dict[str, Any]):
+        """Handle sample counts (C2M1, C3)"""
+        if match := _RE_CM.match(code):
+            result['cortex_count'] = int(match.group(1))
+            result['medulla_count'] = int(match.group(2))
+        elif match := _RE_C.match(code):
+            result['cortex_count'] = int(match.group(1))
+    
+    def _parse_artery_code(self, code: str, result: Dict[str, Any]):
+        """Handle artery count (A3)"""
+        if _RE_A.match(code):
             value = self.extract_numeric_value(code)
             if value:
-                result['artery_count'] = value
-        
-        return result
\ No newline at end of file
+                result['artery_count'] = value
\ No newline at end of file
@@ -3,26 +3,35 @@ Report formatter for organizing medical phrases into structured sections.
 Handles section headers and proper report formatting.
 """
 
+import re
 from typing import List, Dict, Any
 
+_RE_BLANK_LINES = re.compile(r'\n{3,}')
+
+_SECTION_ORDER = (
+    "A. LIGHT MICROSCOPY",
+    "GLOMERULI",
+    "TUBULOINTERSTITIUM",
+    "BLOOD VESSELS",
+    "IMMUNOHISTOCHEMISTRY",
+    "B. ELECTRON MICROSCOPY",
+    "C. IMMUNOFLUORESCENCE (frozen tissue sample)",
+    "CONCLUSION",
+    "COMMENT"
+)
+_HEADERS_UPPER = frozenset(s.upper() for s in _SECTION_ORDER)
+
 
 class ReportFormatter:
     """Formats expanded medical phrases into a structured report."""
     
+    __slots__ = ('section_order', '_headers_upper')
+    
     def __init__(self):
         """Initialize the formatter with section ordering."""
         # Define the order of sections in the final report
-        self.section_order = [
-            "A. LIGHT MICROSCOPY",
-            "GLOMERULI",
-            "TUBULOINTERSTITIUM",
-            "BLOOD VESSELS",
-            "IMMUNOHISTOCHEMISTRY",
-            "B. ELECTRON MICROSCOPY",
-            "C. IMMUNOFLUORESCENCE (frozen tissue sample)",
-            "CONCLUSION",
-            "COMMENT"
-        ]
+        self.section_order = list(_SECTION_ORDER)
+        self._headers_upper = _HEADERS_UPPER
     
     def format_entries(self, entries: List[Dict[str, str]]) -> str:
         """
@@ -44,11 +53,8 @@ class ReportFormatter:
                 # Regular content
                 formatted.append(entry.get('text', ''))
         
-        # Join and clean up extra blank lines
-        report = '\n'.join(formatted)
-        # Remove multiple consecutive blank lines
-        while '\n\n\n' in report:
-            report = report.replace('\n\n\n', '\n\n')
+        # Join and collapse runs of blank lines in a single pass
+        report = _RE_BLANK_LINES.sub('\n\n', '\n'.join(formatted))
         
         return report.strip()
     
@@ -64,10 +70,12 @@ class ReportFormatter:
         """
         entries = []
         
+        headers = self._headers_upper
+        
         for phrase in phrases:
             if phrase and phrase.strip():
                 # Check if this is a header (from ! prefix codes)
-                if phrase.upper() in [s.upper() for s in self.section_order]:
+                if phrase.upper() in headers:
                     entries.append({"type": "header", "text": phrase})
                 else:
                     entries.append({"type": "content", "text": phrase})
@@ -84,5 +92,19 @@ class ReportFormatter:
         Returns:
             Formatted report text
         """
-        entries = self.organize_by_sections(phrases)
-        return self.format_entries(entries)
\ No newline at end of file
+        # Classify and format in one pass; equivalent to
+        # format_entries(organize_by_sections(phrases)) without the entry dicts
+        formatted = []
+        append = formatted.append
+        headers = self._headers_upper
+        
+        for phrase in phrases:
+            if phrase and phrase.strip():
+                if phrase.upper() in headers:
+                    append(f"\n{phrase}\n")
+                else:
+                    append(phrase)
+        
+        report = _RE_BLANK_LINES.sub('\n\n', '\n'.join(formatted))
+        
+        return report.strip()
\ No newline at end of file
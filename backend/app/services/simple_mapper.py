@@ -1,21 +1,90 @@
 """
 Simple mapper for converting shorthand codes to full medical phrases.
 Supports section-specific values and code extraction.
+
+Lookups are str-in/str-out dict and regex work, so they are deliberately not
+compiled with Numba: its nopython mode has no support for these string and
+regex operations, and object-mode fallback is no faster than CPython. Speed
+comes from the memoized lookup, bucketed pattern alternations and
+precompiled templates instead.
 """
 
 import json
+import logging
 import os
 import re
 import shutil
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from functools import lru_cache
 from threading import Lock
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_BACKREFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=")
+# Upper-case class escapes, and escapes that spell a character by code point
+_CASE_SENSITIVE_ESCAPE = re.compile(r"\\[A-Zxu0-7]")
+_TEMPLATE_TOKEN = re.compile(r"\{([1-9]\d*)\}|[{}]")
+
+# Segments tried in order: a pattern, its group index -> (group count, templates)
+# slots, and whether it is a shared alternation (else one rule matched on its own)
+PatternMatcher = Tuple[Tuple[re.Pattern, Dict[int, Tuple[int, Dict[str, str]]], bool], ...]
+
+
+class PatternRule(NamedTuple):
+    """A compiled `~` pattern entry."""
+
+    source: str
+    # Lower-cased source for case-sensitive matching, or None when lower-casing could change its meaning
+    lowered: Optional[str]
+    group_count: int
+    templates: Dict[str, str]
+    # Literal character every match starts with, or None when any character can
+    first_char: Optional[str]
+    # The rule's own pattern when it cannot be spliced into an alternation
+    standalone: Optional[re.Pattern]
+
+
+@lru_cache(maxsize=8)
+def _read_json_file(path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """Parse a JSON file; the stat fields only key the cache.
+
+    Repeated string values (the same phrase under several sections or keys)
+    are collapsed onto one shared object.
+    """
+    pool: Dict[str, str] = {}
+
+    def share_strings(obj: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: pool.setdefault(value, value) if isinstance(value, str) else value for key, value in obj.items()}
+
+    with open(path, "r", encoding="utf-8") as file_handle:
+        return json.load(file_handle, object_hook=share_strings)
+
+
+def load_json_file(path: Union[str, Path]) -> Dict[str, Any]:
+    """Return the parsed JSON at ``path``, shared until the file changes.
+
+    The returned dict is shared between callers and must be treated as
+    read-only; copy it before making changes.
+    """
+    stat = os.stat(path)
+    return _read_json_file(str(path), stat.st_mtime_ns, stat.st_size)
 
 
 class SimpleMapper:
     """Maps shorthand codes to full medical phrases using sectioned JSON lookup."""
 
+    __slots__ = (
+        "json_path",
+        "default_json_path",
+        "_lock",
+        "revision",
+        "_map_code_cached",
+        "_pattern_index",
+        "mappings",
+    )
+
     def __init__(self, json_path: Optional[str] = None):
         """Initialize mapper with phrases from sectioned JSON file."""
         default_json_path = Path(__file__).parent.parent / "data" / "phrases_sectioned.json"
@@ -23,6 +92,8 @@ class SimpleMapper:
         self.json_path = Path(configured_path) if configured_path else default_json_path
         self.default_json_path = default_json_path
         self._lock = Lock()
+        self.revision = 0
+        self._map_code_cached = lru_cache(maxsize=4096)(self._map_code)
         self._ensure_json_exists()
         self._load_mappings()
 
@@ -36,8 +107,189 @@ class SimpleMapper:
 
     def _load_mappings(self) -> None:
         """Load mappings from disk."""
-        with open(self.json_path, "r", encoding="utf-8") as file_handle:
-            self.mappings = json.load(file_handle)
+        mappings = load_json_file(self.json_path)
+        self._pattern_index = self._compile_patterns(mappings)
+        self.mappings = mappings
+
+    @staticmethod
+    def _compile_patterns(mappings: Dict[str, Any]) -> Tuple[PatternMatcher, PatternMatcher, Dict[str, PatternMatcher]]:
+        """Compile the `~` pattern entries into first-character buckets.
+
+        Returns the case-insensitive matcher for all rules, the matcher for
+        rules that can start with any character, and per-character matchers
+        that add the rules starting with that literal character. The bucketed
+        matchers are case-sensitive and expect an ASCII lower-cased code.
+        Every bucket keeps file order, so the first rule that matches still
+        wins; rules that cannot be spliced into an alternation are matched on
+        their own at their place in that order. Stored keys that do not
+        compile are logged and skipped, so a bad entry only loses its own
+        matches instead of stopping the mapper.
+        """
+        rules = []
+        for key, entry in mappings.items():
+            if not key.startswith("~"):
+                continue
+            source = key[1:]
+            try:
+                pattern = re.compile(source, re.IGNORECASE)
+            except re.error as error:
+                logger.warning(f"Skipping invalid pattern key {key}: {error}")
+                continue
+            templates = {
+                section: SimpleMapper._format_template(value, pattern.groups)
+                for section, value in entry.items()
+                if isinstance(value, str) and value
+            }
+            rules.append(
+                PatternRule(
+                    source=source,
+                    lowered=SimpleMapper._lowercase_source(source),
+                    group_count=pattern.groups,
+                    templates=templates,
+                    first_char=SimpleMapper._literal_first_char(source),
+                    standalone=None if SimpleMapper._can_splice(source, pattern) else pattern,
+                )
+            )
+
+        first_chars = {rule.first_char for rule in rules if rule.first_char}
+        buckets = {
+            char: SimpleMapper._build_matcher(
+                [rule for rule in rules if rule.first_char in (None, char)],
+                pre_lowered=True,
+            )
+            for char in first_chars
+        }
+        wildcard = SimpleMapper._build_matcher([rule for rule in rules if rule.first_char is None], pre_lowered=True)
+        return SimpleMapper._build_matcher(rules, pre_lowered=False), wildcard, buckets
+
+    @staticmethod
+    def _can_splice(source: str, pattern: re.Pattern) -> bool:
+        """Return True when ``source`` keeps its meaning inside a shared alternation.
+
+        Group names and numbered backreferences do not survive being spliced
+        into a shared pattern, and global inline flags must start a pattern.
+        """
+        if pattern.groupindex or _BACKREFERENCE.search(source):
+            return False
+        try:
+            re.compile(f"({source})")
+            re.compile(f"(?i:{source})")
+        except re.error:
+            return False
+        return True
+
+    @staticmethod
+    def _validate_pattern_key(key: str) -> None:
+        """Reject a `~` key whose pattern does not compile or uses named groups or backreferences."""
+        if not key.startswith("~"):
+            return
+        try:
+            pattern = re.compile(key[1:], re.IGNORECASE)
+        except re.error as error:
+            raise ValueError(f"Invalid pattern key {key}: {error}") from error
+        if pattern.groupindex or _BACKREFERENCE.search(key):
+            raise ValueError(f"Invalid pattern key {key}: use plain numbered groups without backreferences")
+
+    @staticmethod
+    def _lowercase_source(source: str) -> Optional[str]:
+        """Return a lower-cased pattern equivalent to ``source`` under IGNORECASE for ASCII lower-case input.
+
+        Only plain ASCII sources qualify: no character sets, inline flags,
+        upper-case escapes or code-point escapes (``\\x4A``, ``\\u004A``,
+        octal ``\\112``), whose meaning lower-casing could change.
+        """
+        if not source.isascii() or "[" in source or "(?" in source or _CASE_SENSITIVE_ESCAPE.search(source):
+            return None
+        lowered = source.lower()
+        try:
+            re.compile(lowered)
+        except re.error:
+            return None
+        return lowered
+
+    @staticmethod
+    def _literal_first_char(source: str) -> Optional[str]:
+        """Return the lower-cased ASCII character every match must start with, if obvious."""
+        first = source[:1]
+        if not (first.isascii() and (first.isalnum() or first == "_")):
+            return None
+        # A quantifier could make the first character optional, and a
+        # top-level alternative could start with something else
+        if source[1:2] in ("?", "*", "{") or "|" in source:
+            return None
+        return first.lower()
+
+    @staticmethod
+    def _build_matcher(rules: List[PatternRule], pre_lowered: bool) -> PatternMatcher:
+        """Split rules into ordered segments.
+
+        Each run of spliceable rules becomes one shared alternation; a rule
+        that cannot be spliced becomes a segment of its own, matched with its
+        own case-insensitive pattern.
+        """
+        segments = []
+        run: List[PatternRule] = []
+        for rule in rules:
+            if rule.standalone is None:
+                run.append(rule)
+                continue
+            if run:
+                segments.append(SimpleMapper._join_rules(run, pre_lowered))
+                run = []
+            segments.append((rule.standalone, {0: (rule.group_count, rule.templates)}, False))
+        if run:
+            segments.append(SimpleMapper._join_rules(run, pre_lowered))
+        return tuple(segments)
+
+    @staticmethod
+    def _join_rules(
+        rules: List[PatternRule],
+        pre_lowered: bool,
+    ) -> Tuple[re.Pattern, Dict[int, Tuple[int, Dict[str, str]]], bool]:
+        """Join rules into one alternation, each wrapped in its own capture group.
+
+        One ``match`` call tries the rules in order and ``lastindex`` identifies
+        the winner; the returned dict maps that group index to the rule's own
+        group count and per-section format templates. With ``pre_lowered`` the
+        alternation matches codes that are already lower-cased, case-sensitively:
+        rules use their lower-cased source, or a scoped ``(?i:...)`` group when
+        they have none. Otherwise the original sources are compiled with
+        ``re.IGNORECASE``.
+        """
+        sources = []
+        slots = {}
+        group_index = 1
+        for rule in rules:
+            source = rule.source
+            if pre_lowered:
+                source = rule.lowered if rule.lowered is not None else f"(?i:{source})"
+            sources.append(f"({source})")
+            slots[group_index] = (rule.group_count, rule.templates)
+            group_index += rule.group_count + 1
+
+        try:
+            combined = re.compile("|".join(sources), 0 if pre_lowered else re.IGNORECASE)
+        except re.error as error:
+            raise ValueError(f"Invalid pattern keys: {error}") from error
+        return combined, slots, True
+
+    @staticmethod
+    def _format_template(template: str, group_count: int) -> str:
+        """Turn `{1}`-style placeholders into a ``str.format`` template.
+
+        Placeholders beyond the pattern's group count and any other braces are
+        kept as literal text.
+        """
+
+        def convert(match: re.Match) -> str:
+            index = match.group(1)
+            if index is None:
+                return match.group(0) * 2
+            if int(index) <= group_count:
+                return f"{{{int(index) - 1}}}"
+            return f"{{{{{index}}}}}"
+
+        return _TEMPLATE_TOKEN.sub(convert, template)
 
     def _save_mappings(self) -> None:
         """Persist mappings atomically to disk."""
@@ -50,6 +302,18 @@ class SimpleMapper:
 
         temp_path.replace(self.json_path)
 
+    def _replace_mappings(self, mappings: Dict[str, Any]) -> None:
+        """Swap in an updated mapping dict and persist it.
+
+        Readers on other threads keep iterating the previous dict, so edits
+        never mutate a mapping that a lookup may be walking.
+        """
+        self._pattern_index = self._compile_patterns(mappings)
+        self.mappings = mappings
+        self.revision += 1
+        self._map_code_cached.cache_clear()
+        self._save_mappings()
+
     @staticmethod
     def _normalize_key(key: str) -> str:
         """Normalize a shorthand key."""
@@ -361,11 +625,13 @@ class SimpleMapper:
         normalized_key = self._normalize_key(key)
         if not normalized_key:
             raise ValueError("Phrase key is required.")
+        self._validate_pattern_key(normalized_key)
 
         with self._lock:
             existing_entry = self.mappings.get(normalized_key, {})
-            self.mappings[normalized_key] = self._build_storage_entry(payload, existing_entry)
-            self._save_mappings()
+            mappings = dict(self.mappings)
+            mappings[normalized_key] = self._build_storage_entry(payload, existing_entry)
+            self._replace_mappings(mappings)
 
         return self._normalize_entry(normalized_key, self.mappings[normalized_key])
 
@@ -379,8 +645,9 @@ class SimpleMapper:
             if normalized_key not in self.mappings:
                 raise ValueError(f"Phrase entry not found: {normalized_key}")
 
-            deleted_entry = self._normalize_entry(normalized_key, self.mappings.pop(normalized_key))
-            self._save_mappings()
+            mappings = dict(self.mappings)
+            deleted_entry = self._normalize_entry(normalized_key, mappings.pop(normalized_key))
+            self._replace_mappings(mappings)
 
         return deleted_entry
 
@@ -427,6 +694,20 @@ class SimpleMapper:
 
     def map_code(self, code: str, section: str = "main_body") -> Optional[str]:
         """Map a single shorthand code to its full phrase for a given section."""
+        return self._map_code_cached(code, section, self.revision)
+
+    def map_codes(self, codes: List[str], section: str = "main_body") -> List[Optional[str]]:
+        """Map a batch of shorthand codes for one section, preserving order."""
+        lookup = self._map_code_cached
+        revision = self.revision
+        return [lookup(code, section, revision) for code in codes]
+
+    def _map_code(self, code: str, section: str, revision: int) -> Optional[str]:
+        """Uncached lookup behind map_code.
+
+        ``revision`` only keys the cache, so a lookup racing an edit stores its
+        result under the old revision instead of serving it afterwards.
+        """
         code_lower = self._normalize_key(code)
 
         if code_lower in self.mappings:
@@ -434,19 +715,28 @@ class SimpleMapper:
             value = entry.get(section, "")
             return value if value else None
 
-        for key, entry in self.mappings.items():
-            if key.startswith("~"):
-                pattern = key[1:]
-                match = re.match(pattern, code_lower, re.IGNORECASE)
-                if match:
-                    template = entry.get(section, "")
-                    if not template:
-                        return None
-
-                    result = template
-                    for i, group in enumerate(match.groups(), 1):
-                        result = result.replace(f"{{{i}}}", group)
-                    return result
+        # ASCII codes only try the rules that can start with their first
+        # character, case-sensitively; other codes need full Unicode case
+        # folding against every rule
+        full, wildcard, buckets = self._pattern_index
+        if code_lower.isascii():
+            segments = buckets.get(code_lower[:1], wildcard)
+        else:
+            segments = full
+        for pattern, slots, spliced in segments:
+            match = pattern.match(code_lower)
+            if match is None:
+                continue
+
+            # A rule matched on its own keeps its groups from index 1
+            index = match.lastindex if spliced else 0
+            group_count, templates = slots[index]
+            template = templates.get(section)
+            if template is None:
+                return None
+
+            # An optional group that did not take part substitutes as empty text
+            return template.format(*match.groups("")[index:index + group_count])
 
         return None
 
@@ -3,30 +3,90 @@ Template engine for generating kidney biopsy reports
 Populates templates with standard phrases based on shorthand codes
 """
 
-import json
+import io
 import re
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional
 from pathlib import Path
-from app.services.simple_mapper import SimpleMapper
+from app.services.simple_mapper import SimpleMapper, load_json_file
 from app.services.report_formatter import ReportFormatter
 
+_RE_CM = re.compile(r'C(\d+)M(\d+)')
+_RE_C = re.compile(r'C(\d+)')
+_RE_GS = re.compile(r'[Gg][Ss](\d+)')
+_RE_SS_NOS = re.compile(r'[Ss][Ss](\d+)_NOS')
+_RE_IFTA = re.compile(r'IFTA(\d+)')
+_RE_IL_AR = re.compile(r'(\d+)IL_(\d+)Ar')
+_RE_ARTERY_COUNT = re.compile(r'A(\d+)')
+
+# Small counts are spelled out in the report text
+_CARDINALS = {1: 'One', 2: 'Two', 3: 'Three'}
+# Artery type codes with hand-written phrasing; others use the generic sentence
+_ARTERY_TYPE_PHRASES = {
+    '1IL_0Ar': "One is interlobular.",
+    '2IL_1Ar': "Two are interlobular, 1 is arcuate.",
+}
+
 
 class TemplateEngine:
     """Engine for populating report templates with phrases"""
     
-    def __init__(self, phrases_file: str = None):
-        """Initialize with phrases dictionary"""
+    def __init__(self, phrases_file: str = None, mapper: Optional[SimpleMapper] = None):
+        """Initialize with phrases dictionary and an optional shared mapper"""
+        self._mapper = mapper
+        self._formatter = ReportFormatter()
         if phrases_file:
             self.phrases = self._load_phrases(phrases_file)
         else:
             # Load default transplant phrases
             data_dir = Path(__file__).parent.parent / 'data'
             self.phrases = self._load_phrases(str(data_dir / 'phrases_transplant.json'))
+        self._build_code_lookups()
     
     def _load_phrases(self, filepath: str) -> Dict:
-        """Load phrases from JSON file"""
-        with open(filepath, 'r') as f:
-            return json.load(f)
+        """Load phrases from JSON file, shared with other instances until it changes"""
+        return load_json_file(filepath)
+    
+    def _merge_phrase_groups(self, section: str, groups: List[str]) -> Dict[str, str]:
+        """Flatten several graded phrase groups of a section into one lookup"""
+        lookup = {}
+        for group in groups:
+            lookup.update(self.phrases[section][group])
+        return lookup
+    
+    def _build_code_lookups(self):
+        """Precompute per-section code-to-phrase dicts used by the _process_* methods"""
+        # Keyed by upper-cased code; these codes were always matched case-insensitively
+        self._glomeruli_phrases = self._merge_phrase_groups(
+            'glomeruli',
+            ['mesangial_matrix', 'mesangial_cellularity', 'glomerulitis', 'capillary_double_contours'],
+        )
+        self._tubulointerstitium_phrases = self._merge_phrase_groups(
+            'tubulointerstitium', ['tubulitis', 'inflammation', 'total_inflammation']
+        )
+        self._ct_ci_phrases = self.phrases['tubulointerstitium']['ct_ci_scores']
+        self._blood_vessel_phrases = self._merge_phrase_groups(
+            'blood_vessels',
+            [
+                'fibrointimal_thickening',
+                'chronic_allograft_arteriopathy',
+                'endarteritis',
+                'arteriolar_hyalinosis',
+                'peritubular_capillaritis',
+            ],
+        )
+        self._c4d_phrases = self.phrases['immunohistochemistry']['c4d']
+        
+        # Keyed by the code exactly as typed
+        ati = self.phrases['tubulointerstitium']['acute_tubular_injury']
+        self._ati_phrases = {code: ati[code] for code in ['ATI1', 'ATI2', 'ATI_micro'] if code in ati}
+        if 'ATI1' in ati:
+            self._ati_phrases['ATI micro'] = ati['ATI1']
+    
+    def _get_mapper(self) -> SimpleMapper:
+        """Return the shared mapper, loading the sectioned phrases on first use"""
+        if self._mapper is None:
+            self._mapper = SimpleMapper()
+        return self._mapper
     
     def generate_report_simple(self, parsed_data: Dict[str, Any]) -> str:
         """
@@ -39,9 +99,8 @@ class TemplateEngine:
         Returns:
             Complete formatted report text
         """
-        # Initialize the simple mapper and formatter
-        mapper = SimpleMapper()
-        formatter = ReportFormatter()
+        mapper = self._get_mapper()
+        formatter = self._formatter
         
         # Collect all expanded phrases
         phrases = []
@@ -66,11 +125,9 @@ class TemplateEngine:
             
             # Process codes in this section
             if isinstance(codes, list):
-                for code in codes:
-                    if code and code.strip():
-                        expanded = mapper.map_code(code.strip())
-                        if expanded:
-                            phrases.append(expanded)
+                stripped = [code.strip() for code in codes if code]
+                expanded = mapper.map_codes([code for code in stripped if code])
+                phrases.extend(phrase for phrase in expanded if phrase)
         
         # Format the report
         return formatter.format_report(phrases)
@@ -100,86 +157,75 @@ class TemplateEngine:
         Returns:
             Complete formatted report text
         """
-        report_lines = []
+        buffer = io.StringIO()
+        write = buffer.write
+        
+        def write_lines(lines: List[str], prefix: str = ''):
+            for line in lines:
+                write(prefix)
+                write(line)
+                write('\n')
         
         # Add patient information
         patient_info = parsed_data.get('patient_info', {})
         if patient_info:
-            report_lines.extend(self._format_patient_info(patient_info))
-            report_lines.append("")
+            write_lines(self._format_patient_info(patient_info))
+            write('\n')
         
         # Add sections
         sections = parsed_data.get('sections', {})
         
         # Light Microscopy
         if 'light_microscopy' in sections or 'glomeruli' in sections or 'tubulointerstitium' in sections or 'blood_vessels' in sections:
-            report_lines.append("A. LIGHT MICROSCOPY")
+            write("A. LIGHT MICROSCOPY\n")
             
             # Sample description
             if 'light_microscopy' in sections:
-                lm_phrases = self._process_light_microscopy(sections['light_microscopy'])
-                report_lines.extend(lm_phrases)
+                write_lines(self._process_light_microscopy(sections['light_microscopy']))
             
             # Glomeruli
             if 'glomeruli' in sections:
-                report_lines.append("")
-                report_lines.append("GLOMERULI")
-                glom_phrases = self._process_glomeruli(sections['glomeruli'])
-                report_lines.extend(glom_phrases)
+                write("\nGLOMERULI\n")
+                write_lines(self._process_glomeruli(sections['glomeruli']))
             
             # Tubulointerstitium
             if 'tubulointerstitium' in sections:
-                report_lines.append("")
-                report_lines.append("TUBULOINTERSTITIUM")
-                ti_phrases = self._process_tubulointerstitium(sections['tubulointerstitium'])
-                report_lines.extend(ti_phrases)
+                write("\nTUBULOINTERSTITIUM\n")
+                write_lines(self._process_tubulointerstitium(sections['tubulointerstitium']))
             
             # Blood Vessels
             if 'blood_vessels' in sections:
-                report_lines.append("")
-                report_lines.append("BLOOD VESSELS")
-                ves_phrases = self._process_blood_vessels(sections['blood_vessels'])
-                report_lines.extend(ves_phrases)
+                write("\nBLOOD VESSELS\n")
+                write_lines(self._process_blood_vessels(sections['blood_vessels']))
         
         # Immunohistochemistry
         if 'immunohistochemistry' in sections:
-            report_lines.append("")
-            report_lines.append("IMMUNOHISTOCHEMISTRY")
-            ihc_phrases = self._process_immunohistochemistry(sections['immunohistochemistry'])
-            report_lines.extend(ihc_phrases)
+            write("\nIMMUNOHISTOCHEMISTRY\n")
+            write_lines(self._process_immunohistochemistry(sections['immunohistochemistry']))
         
         # Electron Microscopy
         if 'electron_microscopy' in sections:
-            report_lines.append("")
-            report_lines.append("B.ELECTRON MICROSCOPY")
-            em_phrases = self._process_electron_microscopy(sections['electron_microscopy'])
-            report_lines.extend(em_phrases)
+            write("\nB.ELECTRON MICROSCOPY\n")
+            write_lines(self._process_electron_microscopy(sections['electron_microscopy']))
         
         # Immunofluorescence
         if 'immunofluorescence' in sections:
             if sections['immunofluorescence'] and sections['immunofluorescence'][0] != 'FR_0':
-                report_lines.append("")
-                report_lines.append("C.IMMUNOFLUORESCENCE (frozen tissue sample)")
-                if_phrases = self._process_immunofluorescence(sections['immunofluorescence'])
-                report_lines.extend(if_phrases)
+                write("\nC.IMMUNOFLUORESCENCE (frozen tissue sample)\n")
+                write_lines(self._process_immunofluorescence(sections['immunofluorescence']))
         
         # Conclusion
         if 'conclusion' in sections:
-            report_lines.append("")
-            report_lines.append("CONCLUSION")
-            report_lines.append("Transplant kidney biopsy:")
-            conclusion_phrases = self._process_conclusion(sections['conclusion'])
-            for i, phrase in enumerate(conclusion_phrases, 1):
-                report_lines.append(f"\t{phrase}")
+            write("\nCONCLUSION\nTransplant kidney biopsy:\n")
+            write_lines(self._process_conclusion(sections['conclusion']), prefix='\t')
         
         # Comment
         if 'comment' in sections:
-            report_lines.append("")
-            report_lines.append("COMMENT")
-            comment_phrases = self._process_comment(sections['comment'])
-            report_lines.extend(comment_phrases)
+            write("\nCOMMENT\n")
+            write_lines(self._process_comment(sections['comment']))
         
-        return '\n'.join(report_lines)
+        # Every line was written with a trailing newline; drop the final one
+        return buffer.getvalue()[:-1]
     
     def _format_patient_info(self, patient_info: Dict) -> List[str]:
         """Format patient information section"""
@@ -196,134 +242,89 @@ class TemplateEngine:
         
         return lines
     
-    def _process_light_microscopy(self, codes: List[str]) -> List[str]:
+    @staticmethod
+    def _lookup_phrases(codes: List[str], table: Dict[str, str]) -> Iterator[str]:
+        """Yield the phrases for codes found in an exact-match table, in order"""
+        return (table[code] for code in codes if code in table)
+    
+    def _process_light_microscopy(self, codes: List[str]) -> Iterator[str]:
         """Process light microscopy section codes"""
-        phrases = []
-        
         for code in codes:
             # Handle sample description
             if code in self.phrases['light_microscopy']['sample']:
-                phrases.append(self.phrases['light_microscopy']['sample'][code])
-            # Handle sample counts (C2M1)
-            elif re.match(r'C\d+M\d+', code):
-                match = re.match(r'C(\d+)M(\d+)', code)
-                if match:
+                yield self.phrases['light_microscopy']['sample'][code]
+            # Handle sample counts (C2M1); both patterns need a leading 'C'
+            elif code.startswith('C'):
+                if match := _RE_CM.match(code):
                     c_count = int(match.group(1))
                     m_count = int(match.group(2))
                     if c_count == 2 and m_count == 1:
-                        phrases.append("There are 2 samples of cortex and 1 sample of medulla.")
+                        yield "There are 2 samples of cortex and 1 sample of medulla."
                     else:
-                        phrases.append(f"There are {c_count} samples of cortex and {m_count} samples of medulla.")
-            elif re.match(r'C\d+', code):
-                match = re.match(r'C(\d+)', code)
-                if match:
+                        yield f"There are {c_count} samples of cortex and {m_count} samples of medulla."
+                elif match := _RE_C.match(code):
                     count = int(match.group(1))
                     if count == 1:
-                        phrases.append("There is 1 sample of cortex.")
+                        yield "There is 1 sample of cortex."
                     else:
-                        phrases.append(f"There are {count} samples of cortex.")
-        
-        return phrases
+                        yield f"There are {count} samples of cortex."
     
-    def _process_glomeruli(self, codes: List[str]) -> List[str]:
+    def _process_glomeruli(self, codes: List[str]) -> Iterator[str]:
         """Process glomeruli section codes"""
-        phrases = []
-        
         for code in codes:
+            key = code.upper()
+            phrase = self._glomeruli_phrases.get(key)
+            if phrase is not None:
+                yield phrase
+            
             # Total glomeruli count (just a number)
-            if code.isdigit():
-                phrases.append(f"Total number of glomeruli: {code}")
+            elif code.isdigit():
+                yield f"Total number of glomeruli: {code}"
             
             # Globally sclerosed
             elif code.startswith('GS') or code.startswith('Gs'):
-                match = re.match(r'[Gg][Ss](\d+)', code)
+                match = _RE_GS.match(code)
                 if match:
                     count = int(match.group(1))
-                    phrases.append(f"Number of globally sclerosed glomeruli: {count}")
+                    yield f"Number of globally sclerosed glomeruli: {count}"
             
             # Segmental sclerosis
             elif code.startswith('SS') or code.startswith('Ss'):
                 if code == 'SS0' or code == 'Ss0':
-                    phrases.append("No segmental sclerosis is seen.")
+                    yield "No segmental sclerosis is seen."
                 elif '_NOS' in code:
-                    match = re.match(r'[Ss][Ss](\d+)_NOS', code)
+                    match = _RE_SS_NOS.match(code)
                     if match:
                         count = int(match.group(1))
                         if count == 1:
-                            phrases.append("One glomerulus shows segmental sclerosis (NOS).")
+                            yield "One glomerulus shows segmental sclerosis (NOS)."
                         else:
-                            phrases.append(f"{count} glomeruli show segmental sclerosis (NOS)")
-            
-            # Mesangial matrix
-            elif code.upper() in ['MM0', 'MM1', 'MM2', 'MM3']:
-                key = code.upper()
-                if key in self.phrases['glomeruli']['mesangial_matrix']:
-                    phrases.append(self.phrases['glomeruli']['mesangial_matrix'][key])
-            
-            # Mesangial cellularity
-            elif code.upper() in ['MC0', 'MC1', 'MC2', 'MC3']:
-                key = code.upper()
-                if key in self.phrases['glomeruli']['mesangial_cellularity']:
-                    phrases.append(self.phrases['glomeruli']['mesangial_cellularity'][key])
-            
-            # Glomerulitis
-            elif code.upper() in ['G0', 'G1', 'G2', 'G3']:
-                key = code.upper()
-                if key in self.phrases['glomeruli']['glomerulitis']:
-                    phrases.append(self.phrases['glomeruli']['glomerulitis'][key])
-            
-            # Capillary double contours
-            elif code.upper() in ['CG0', 'CG1', 'CG2', 'CG3']:
-                key = code.upper()
-                if key in self.phrases['glomeruli']['capillary_double_contours']:
-                    phrases.append(self.phrases['glomeruli']['capillary_double_contours'][key])
-        
-        return phrases
+                            yield f"{count} glomeruli show segmental sclerosis (NOS)"
     
-    def _process_tubulointerstitium(self, codes: List[str]) -> List[str]:
+    def _process_tubulointerstitium(self, codes: List[str]) -> Iterator[str]:
         """Process tubulointerstitium section codes"""
         phrases = []
         ifta_phrase = None
         ctci_phrase = None
         
         for code in codes:
-            # Acute tubular injury
-            if code in ['ATI1', 'ATI2', 'ATI_micro', 'ATI micro']:
-                if code == 'ATI micro':
-                    code = 'ATI1'  # Map to ATI1
-                if code in self.phrases['tubulointerstitium']['acute_tubular_injury']:
-                    phrases.append(self.phrases['tubulointerstitium']['acute_tubular_injury'][code])
+            key = code.upper()
+            phrase = self._ati_phrases.get(code)
+            if phrase is None:
+                phrase = self._tubulointerstitium_phrases.get(key)
+            if phrase is not None:
+                phrases.append(phrase)
             
             # IFTA percentage
             elif code.startswith('IFTA'):
-                match = re.match(r'IFTA(\d+)', code)
+                match = _RE_IFTA.match(code)
                 if match:
                     percentage = match.group(1)
                     ifta_phrase = f"Tubular atrophy/interstitial fibrosis (nearest 10%): {percentage}%"
             
             # CT/CI scores
-            elif code.upper() in ['CT1CI0', 'CTCI1', 'CTCI2', 'CTCI3']:
-                key = code.upper()
-                if key in self.phrases['tubulointerstitium']['ct_ci_scores']:
-                    ctci_phrase = self.phrases['tubulointerstitium']['ct_ci_scores'][key]
-            
-            # Tubulitis
-            elif code.upper() in ['T0', 'T1', 'T2', 'T3']:
-                key = code.upper()
-                if key in self.phrases['tubulointerstitium']['tubulitis']:
-                    phrases.append(self.phrases['tubulointerstitium']['tubulitis'][key])
-            
-            # Inflammation scores
-            elif '_I-IFTA' in code.upper():
-                key = code.upper().replace('-', '-')
-                if key in self.phrases['tubulointerstitium']['inflammation']:
-                    phrases.append(self.phrases['tubulointerstitium']['inflammation'][key])
-            
-            # Total inflammation
-            elif code.upper() in ['TI0', 'TI1', 'TI2', 'TI3']:
-                key = code.upper()
-                if key in self.phrases['tubulointerstitium']['total_inflammation']:
-                    phrases.append(self.phrases['tubulointerstitium']['total_inflammation'][key])
+            elif key in self._ct_ci_phrases:
+                ctci_phrase = self._ct_ci_phrases[key]
         
         # Add IFTA and CT/CI together
         if ifta_phrase:
@@ -332,124 +333,60 @@ class TemplateEngine:
             else:
                 phrases.insert(1 if phrases else 0, ifta_phrase)
         
-        return phrases
+        yield from phrases
     
-    def _process_blood_vessels(self, codes: List[str]) -> List[str]:
+    def _process_blood_vessels(self, codes: List[str]) -> Iterator[str]:
         """Process blood vessels section codes"""
-        phrases = []
-        
         for code in codes:
+            key = code.upper()
+            phrase = self._blood_vessel_phrases.get(key)
+            if phrase is not None:
+                yield phrase
+            
             # Artery count
-            if code.startswith('A') and code[1:].isdigit():
-                count = int(code[1:])
+            elif match := _RE_ARTERY_COUNT.fullmatch(code):
+                count = int(match.group(1))
+                word = _CARDINALS.get(count, count)
                 if count == 1:
-                    phrases.append("One artery is present in the sampled kidney.")
-                elif count == 2:
-                    phrases.append("Two arteries are present in the sampled kidney.")
-                elif count == 3:
-                    phrases.append("Three arteries are present in the sampled kidney.")
+                    yield f"{word} artery is present in the sampled kidney."
                 else:
-                    phrases.append(f"{count} arteries are present in the sampled kidney.")
+                    yield f"{word} arteries are present in the sampled kidney."
             
             # Artery types
             elif 'IL' in code and 'Ar' in code:
-                if code == '1IL_0Ar':
-                    phrases.append("One is interlobular.")
-                elif code == '2IL_1Ar':
-                    phrases.append("Two are interlobular, 1 is arcuate.")
+                if code in _ARTERY_TYPE_PHRASES:
+                    yield _ARTERY_TYPE_PHRASES[code]
                 else:
-                    match = re.match(r'(\d+)IL_(\d+)Ar', code)
+                    match = _RE_IL_AR.match(code)
                     if match:
                         il_count = int(match.group(1))
                         ar_count = int(match.group(2))
-                        phrases.append(f"{il_count} are interlobular, {ar_count} are arcuate.")
-            
-            # CV scores
-            elif code.upper() in ['CV0', 'CV1', 'CV2', 'CV3']:
-                key = code.upper()
-                if key in self.phrases['blood_vessels']['fibrointimal_thickening']:
-                    phrases.append(self.phrases['blood_vessels']['fibrointimal_thickening'][key])
-            
-            # CAA scores
-            elif code.upper() in ['CAA0', 'CAA1']:
-                key = code.upper()
-                if key in self.phrases['blood_vessels']['chronic_allograft_arteriopathy']:
-                    phrases.append(self.phrases['blood_vessels']['chronic_allograft_arteriopathy'][key])
-            
-            # V scores
-            elif code.upper() in ['V0', 'V1', 'V2', 'V3']:
-                key = code.upper()
-                if key in self.phrases['blood_vessels']['endarteritis']:
-                    phrases.append(self.phrases['blood_vessels']['endarteritis'][key])
-            
-            # AH scores
-            elif code.upper() in ['AH0', 'AH1', 'AH2', 'AH3']:
-                key = code.upper()
-                if key in self.phrases['blood_vessels']['arteriolar_hyalinosis']:
-                    phrases.append(self.phrases['blood_vessels']['arteriolar_hyalinosis'][key])
-            
-            # PTC scores
-            elif code.upper() in ['PTC0', 'PTC1', 'PTC2', 'PTC3']:
-                key = code.upper()
-                if key in self.phrases['blood_vessels']['peritubular_capillaritis']:
-                    phrases.append(self.phrases['blood_vessels']['peritubular_capillaritis'][key])
-        
-        return phrases
+                        yield f"{il_count} are interlobular, {ar_count} are arcuate."
     
-    def _process_immunohistochemistry(self, codes: List[str]) -> List[str]:
+    def _process_immunohistochemistry(self, codes: List[str]) -> Iterator[str]:
         """Process immunohistochemistry section codes"""
-        phrases = []
+        sv40 = self.phrases['immunohistochemistry']['sv40']
         
         for code in codes:
-            # C4d staining
-            if code.upper() in ['C4D0', 'C4D1', 'C4D2', 'C4D3']:
-                key = code.upper()
-                if key in self.phrases['immunohistochemistry']['c4d']:
-                    phrases.append(self.phrases['immunohistochemistry']['c4d'][key])
-            
-            # SV40 staining
-            elif code in ['SV40_0', 'SV40_1', 'SV40_2']:
-                if code in self.phrases['immunohistochemistry']['sv40']:
-                    phrases.append(self.phrases['immunohistochemistry']['sv40'][code])
-        
-        return phrases
+            # C4d codes are case-insensitive, SV40 codes must match exactly
+            phrase = self._c4d_phrases.get(code.upper())
+            if phrase is None:
+                phrase = sv40.get(code)
+            if phrase is not None:
+                yield phrase
     
-    def _process_electron_microscopy(self, codes: List[str]) -> List[str]:
+    def _process_electron_microscopy(self, codes: List[str]) -> Iterator[str]:
         """Process electron microscopy section codes"""
-        phrases = []
-        
-        for code in codes:
-            if code in self.phrases['electron_microscopy']:
-                phrases.append(self.phrases['electron_microscopy'][code])
-        
-        return phrases
+        return self._lookup_phrases(codes, self.phrases['electron_microscopy'])
     
-    def _process_immunofluorescence(self, codes: List[str]) -> List[str]:
+    def _process_immunofluorescence(self, codes: List[str]) -> Iterator[str]:
         """Process immunofluorescence section codes"""
-        phrases = []
-        
-        for code in codes:
-            if code in self.phrases['immunofluorescence']:
-                phrases.append(self.phrases['immunofluorescence'][code])
-        
-        return phrases
+        return self._lookup_phrases(codes, self.phrases['immunofluorescence'])
     
-    def _process_conclusion(self, codes: List[str]) -> List[str]:
+    def _process_conclusion(self, codes: List[str]) -> Iterator[str]:
         """Process conclusion section codes"""
-        phrases = []
-        
-        for code in codes:
-            if code in self.phrases['conclusion']:
-                phrases.append(self.phrases['conclusion'][code])
-        
-        return phrases
+        return self._lookup_phrases(codes, self.phrases['conclusion'])
     
-    def _process_comment(self, codes: List[str]) -> List[str]:
+    def _process_comment(self, codes: List[str]) -> Iterator[str]:
         """Process comment section codes"""
-        phrases = []
-        
-        for code in codes:
-            if code in self.phrases['comment']:
-                phrases.append(self.phrases['comment'][code])
-        
-        return phrases
\ No newline at end of file
+        return self._lookup_phrases(codes, self.phrases['comment'])
\ No newline at end of file
@@ -3,8 +3,10 @@
 Test script to verify the backend works with the provided examples
 """
 
+import io
 import sys
 import os
+from contextlib import redirect_stdout
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app.services.parser import ShorthandParser
@@ -46,13 +48,12 @@ IFFR: FR0
 CONCLUSION: ATI_micro
 COMMENT: ATI_micro, DP"""
 
-def test_example(shorthand, example_num):
+def test_example(shorthand, example_num, parser, engine):
     print(f"\n{'='*60}")
     print(f"Testing Example {example_num}")
     print('='*60)
     
     # Parse the shorthand
-    parser = ShorthandParser()
     parsed_data = parser.parse(shorthand)
     
     print("\nParsed Data:")
@@ -60,7 +61,6 @@ def test_example(shorthand, example_num):
     print(f"Sections: {list(parsed_data['sections'].keys())}")
     
     # Generate the report
-    engine = TemplateEngine()
     report = engine.generate_report(parsed_data)
     
     print("\nGenerated Report:")
@@ -71,12 +71,22 @@ def test_example(shorthand, example_num):
     return report
 
 if __name__ == "__main__":
-    # Test Example 1
-    report1 = test_example(example1_shorthand, 1)
+    # Build the parser and engine once and share them across examples
+    parser = ShorthandParser()
+    engine = TemplateEngine()
+    
+    # Collect the output and write it in one go at the end
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            # Test Example 1
+            report1 = test_example(example1_shorthand, 1, parser, engine)
     
-    # Test Example 2
-    report2 = test_example(example2_shorthand, 2)
+            # Test Example 2
+            report2 = test_example(example2_shorthand, 2, parser, engine)
     
-    print("\n" + "="*60)
-    print("Testing complete!")
-    print("="*60)
\ No newline at end of file
+            print("\n" + "="*60)
+            print("Testing complete!")
+            print("="*60)
+    finally:
+        sys.stdout.write(output.getvalue())
\ No newline at end of file
@@ -2,10 +2,14 @@
 """
 Test script for the simplified autocomplete implementation.
 Tests the SimpleMapper and ReportFormatter without needing FastAPI.
+The line-mapping check calls the /api/generate handler directly.
 """
 
+import io
 import sys
 import os
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app.services.simple_mapper import SimpleMapper
@@ -106,12 +110,8 @@ def test_full_pipeline():
     print("\nInput shorthand codes:")
     print(", ".join(shorthand_codes))
     
-    # Process codes
-    expanded_phrases = []
-    for code in shorthand_codes:
-        expanded = mapper.map_code(code)
-        if expanded:
-            expanded_phrases.append(expanded)
+    # Process codes in one batch lookup
+    expanded_phrases = [expanded for expanded in mapper.map_codes(shorthand_codes) if expanded]
     
     print("\nExpanded phrases:")
     for phrase in expanded_phrases:
@@ -123,11 +123,69 @@ def test_full_pipeline():
     print("-" * 40)
     print(report)
 
-if __name__ == "__main__":
-    test_simple_mapper()
-    test_report_formatter()
-    test_full_pipeline()
-    
+def test_line_mappings():
+    """Test the line mappings /api/generate returns on request."""
     print("\n" + "=" * 60)
-    print("✓ All tests completed successfully!")
-    print("=" * 60)
\ No newline at end of file
+    print("Testing Line Mappings")
+    print("=" * 60)
+    
+    with TemporaryDirectory() as temp_dir:
+        # Point the app at a scratch copy of the dictionary so the multi-line
+        # test phrase is never written to the real one
+        previous_path = os.environ.get("PHRASES_JSON_PATH")
+        os.environ["PHRASES_JSON_PATH"] = os.path.join(temp_dir, "phrases_sectioned.json")
+        try:
+            from app.main import generate_report, simple_mapper
+            from app.models.shorthand import ShorthandInput
+        finally:
+            if previous_path is None:
+                os.environ.pop("PHRASES_JSON_PATH")
+            else:
+                os.environ["PHRASES_JSON_PATH"] = previous_path
+        simple_mapper.upsert_phrase_entry("zz", {"main_body": "Line A\nLine B"})
+        
+        # (shorthand, expected (line number, source code, line text) mappings)
+        mapping_tests = [
+            ("g0 tg5 \n", [(1, "tg5", "There is no glomerulitis (g0). Total number of glomeruli: 5 ")]),
+            (
+                "g0 !conc bl \n",
+                [
+                    (1, "g0", "There is no glomerulitis (g0). "),
+                    (2, "bl", "CONCLUSION Borderline for T cell-mediated rejection "),
+                ],
+            ),
+            ("@free\ntext@ g0 \n", [(1, "", "free"), (2, "g0", "text There is no glomerulitis (g0). ")]),
+            (
+                "g0 zz tg5 \n",
+                [
+                    (1, "zz", "There is no glomerulitis (g0). Line A"),
+                    (2, "tg5", "Line B Total number of glomeruli: 5 "),
+                ],
+            ),
+            ("zz \n", [(1, "zz", "Line A"), (2, "zz", "Line B ")]),
+        ]
+        
+        for shorthand, expected in mapping_tests:
+            report = generate_report(ShorthandInput(shorthand_text=shorthand, include_line_mappings=True))
+            result = [
+                (mapping.line_number, mapping.source_code, mapping.original_text)
+                for mapping in report.line_mappings
+            ]
+            status = "✓" if result == expected else "✗"
+            print(f"  {status} {shorthand!r}: {result}")
+
+if __name__ == "__main__":
+    # Collect the output and write it in one go at the end
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            test_simple_mapper()
+            test_report_formatter()
+            test_full_pipeline()
+            test_line_mappings()
+    
+            print("\n" + "=" * 60)
+            print("✓ All tests completed successfully!")
+            print("=" * 60)
+    finally:
+        sys.stdout.write(output.getvalue())
\ No newline at end of file
@@ -3,24 +3,40 @@
 Convert phrases_flat.json to Excel format with keys and values in separate columns.
 """
 
-import json
-import pandas as pd
 import argparse
+import mmap
+import orjson
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+def text_cell(worksheet, text):
+    """Build a cell that is always stored as text, even if it starts with '='."""
+    cell = WriteOnlyCell(worksheet, value=text)
+    cell.data_type = 's'
+    return cell
 
 def convert_json_to_excel(json_file_path, excel_file_path):
     """Convert JSON file to Excel with keys and values in separate columns."""
     
-    # Read the JSON file
-    with open(json_file_path, 'r') as f:
-        data = json.load(f)
+    # Read the JSON file; orjson parses the memory-mapped pages in place
+    with open(json_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            data = orjson.loads(view)
     
-    # Create DataFrame with keys and values
-    df = pd.DataFrame(list(data.items()), columns=['Key', 'Value'])
+    # Stream rows straight into a write-only workbook (no DataFrame copy)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append(['Key', 'Value'])
+    for key, value in data.items():
+        # Nested values (e.g. sectioned entries) are written as JSON text
+        if not isinstance(value, str):
+            value = orjson.dumps(value).decode()
+        worksheet.append([text_cell(worksheet, key), text_cell(worksheet, value)])
     
     # Write to Excel
-    df.to_excel(excel_file_path, index=False)
+    workbook.save(excel_file_path)
     print(f"Successfully converted {json_file_path} to {excel_file_path}")
-    print(f"Total entries: {len(df)}")
+    print(f"Total entries: {len(data)}")
 
 def main():
     parser = argparse.ArgumentParser(description='Convert phrases_flat.json to Excel format')